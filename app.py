@@ -5,22 +5,14 @@ Routes commands to Vertex AI Claude using YOUR GCP credits
 """
 
 import streamlit as st
-import os
-from datetime import datetime
-from google.cloud import firestore
-from vertex_claude import VertexClaude
+from collections import deque
+from chat_types import Msg
+from vertex_claude import VertexClaude, ChatError, MAX_TURNS
 from context_manager import ContextManager
-
-# Page config
-st.set_page_config(
-    page_title="Valhalla AI Partnership Hub V1.0",
-    page_icon="⚡",
-    layout="wide",
-    initial_sidebar_state="expanded"
-)
+from semantic_cache import SemanticCache
 
 # Custom CSS matching your screenshot
-st.markdown("""
+_CSS = """
 <style>
     /* Dark theme base */
     .stApp {
@@ -34,39 +26,6 @@ st.markdown("""
         border-right: 1px solid #1a2332;
     }
     
-    /* Project cards */
-    .project-card {
-        background: linear-gradient(135deg, #10b981 0%, #059669 100%);
-        padding: 15px;
-        border-radius: 10px;
-        margin: 10px 0;
-        cursor: pointer;
-    }
-    
-    .project-card-building {
-        background: linear-gradient(135deg, #8b5cf6 0%, #7c3aed 100%);
-    }
-    
-    .project-card-planning {
-        background: linear-gradient(135deg, #3b82f6 0%, #2563eb 100%);
-    }
-    
-    /* Status indicators */
-    .status-live {
-        color: #10b981;
-        font-size: 0.9em;
-    }
-    
-    .status-building {
-        color: #8b5cf6;
-        font-size: 0.9em;
-    }
-    
-    .status-planning {
-        color: #3b82f6;
-        font-size: 0.9em;
-    }
-    
     /* Quick actions */
     .action-button {
         background-color: #1a2332;
@@ -97,6 +56,10 @@ st.markdown("""
         font-size: 0.85em;
     }
     
+    .connection-status-offline {
+        color: #ef4444;
+    }
+    
     /* Chat input */
     .stTextInput input {
         background-color: #1a2332 !important;
@@ -114,7 +77,32 @@ st.markdown("""
         font-weight: 600;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+
+# Chat messages rendered per page; older ones are loaded on demand
+MESSAGE_PAGE_SIZE = 50
+
+# Page config
+st.set_page_config(
+    page_title="Valhalla AI Partnership Hub V1.0",
+    page_icon="⚡",
+    layout="wide",
+    initial_sidebar_state="expanded"
+)
+
+# Custom CSS, injected from cache on every rerun
+@st.cache_data
+def _inject_css():
+    st.markdown(_CSS, unsafe_allow_html=True)
+
+_inject_css()
+
+# Answers are shared by every session in the process
+@st.cache_resource
+def _get_semantic_cache():
+    return SemanticCache()
+
+semantic_cache = _get_semantic_cache()
 
 # Initialize session state
 if 'context_manager' not in st.session_state:
@@ -122,9 +110,15 @@ if 'context_manager' not in st.session_state:
 if 'vertex_claude' not in st.session_state:
     st.session_state.vertex_claude = VertexClaude()
 if 'messages' not in st.session_state:
+    # Full conversation: rendered and persisted
     st.session_state.messages = []
+if 'model_history' not in st.session_state:
+    # Completed turns sent to the model, truncated on append
+    st.session_state.model_history = deque(maxlen=MAX_TURNS)
 if 'current_project' not in st.session_state:
     st.session_state.current_project = 'HAVEN Platform'
+if 'visible_messages' not in st.session_state:
+    st.session_state.visible_messages = MESSAGE_PAGE_SIZE
 
 # Sidebar
 with st.sidebar:
@@ -134,22 +128,22 @@ with st.sidebar:
     st.markdown("---")
     st.markdown("### PROJECTS")
     
-    # Project list
+    # Project list: one radio widget instead of a column/button pair per project
     projects = [
-        ("🏠", "HAVEN Platform", "Live", "project-card"),
-        ("🚀", "First Contact", "Building", "project-card-building"),
-        ("🌐", "Company Site", "Planning", "project-card-planning")
+        ("🏠", "HAVEN Platform", "Live", "green"),
+        ("🚀", "First Contact", "Building", "violet"),
+        ("🌐", "Company Site", "Planning", "blue")
     ]
+    project_icons = {name: icon for icon, name, _, _ in projects}
     
-    for icon, name, status, card_class in projects:
-        col1, col2 = st.columns([1, 4])
-        with col1:
-            st.markdown(f"<div style='font-size: 2em;'>{icon}</div>", unsafe_allow_html=True)
-        with col2:
-            if st.button(f"{name}", key=f"proj_{name}", use_container_width=True):
-                st.session_state.current_project = name
-            status_class = f"status-{status.lower()}"
-            st.markdown(f"<span class='{status_class}'>⚡ {status}</span>", unsafe_allow_html=True)
+    st.radio(
+        "Projects",
+        [name for _, name, _, _ in projects],
+        format_func=lambda name: f"{project_icons[name]} {name}",
+        captions=[f":{color}[⚡ {status}]" for _, _, status, color in projects],
+        key="current_project",
+        label_visibility="collapsed"
+    )
     
     if st.button("➕ New Project", use_container_width=True):
         st.session_state.show_new_project = True
@@ -167,24 +161,21 @@ with st.sidebar:
         st.info("Opening configuration...")
     
     st.markdown("---")
-    st.markdown("### 💵 Today's Usage")
-    
-    st.markdown("""
-    <div class='usage-stat'>
-        <span>Total Cost:</span>
-        <span style='color: #10b981;'>$0.0000</span>
-    </div>
-    <div class='usage-stat'>
-        <span>Requests:</span>
-        <span>0</span>
-    </div>
-    <div class='usage-stat'>
-        <span>Model:</span>
-        <span>Sonnet 4</span>
-    </div>
-    """, unsafe_allow_html=True)
-    
-    st.markdown("<div class='connection-status'>● Vertex AI Connected</div>", unsafe_allow_html=True)
+    st.markdown("### 💵 Session Usage")
+    
+    # Filled in at the end of the run, so it includes this run's request
+    usage_placeholder = st.empty()
+    
+    # Reads what the clients resolved at startup, so reruns never probe the network
+    connections = [
+        ("Vertex AI", st.session_state.vertex_claude.model is not None),
+        ("Firestore", st.session_state.context_manager.db is not None)
+    ]
+    st.markdown("".join(
+        f"<div class='connection-status{'' if connected else ' connection-status-offline'}'>"
+        f"● {service} {'Connected' if connected else 'Not Configured'}</div>"
+        for service, connected in connections
+    ), unsafe_allow_html=True)
 
 # Main content area
 col1, col2 = st.columns([3, 1])
@@ -193,26 +184,34 @@ with col1:
 with col2:
     if st.button("Clear Chat", use_container_width=True):
         st.session_state.messages = []
+        st.session_state.model_history.clear()
+        st.session_state.visible_messages = MESSAGE_PAGE_SIZE
         st.rerun()
 
 # Initialize message
 if not st.session_state.messages:
-    st.session_state.messages.append({
-        "role": "assistant",
-        "content": "⚡ Valhalla AI Partnership Hub initialized. Claude is ready to collaborate."
-    })
+    st.session_state.messages.append(Msg(
+        role="assistant",
+        content="⚡ Valhalla AI Partnership Hub initialized. Claude is ready to collaborate."
+    ))
+
+# Display chat messages, newest page only
+hidden_messages = len(st.session_state.messages) - st.session_state.visible_messages
+if hidden_messages > 0:
+    if st.button(f"Load older messages ({hidden_messages})", use_container_width=True):
+        st.session_state.visible_messages += MESSAGE_PAGE_SIZE
+        st.rerun()
 
-# Display chat messages
-for message in st.session_state.messages:
-    with st.chat_message(message["role"]):
-        st.markdown(message["content"])
+for message in st.session_state.messages[-st.session_state.visible_messages:]:
+    with st.chat_message(message.role):
+        st.markdown(message.content)
 
 # Chat input
 user_input = st.chat_input(f"Ask Claude about {st.session_state.current_project}...")
 
 if user_input:
     # Add user message
-    st.session_state.messages.append({"role": "user", "content": user_input})
+    st.session_state.messages.append(Msg(role="user", content=user_input))
     with st.chat_message("user"):
         st.markdown(user_input)
     
@@ -224,21 +223,60 @@ if user_input:
                 st.session_state.current_project
             )
             
-            # Route to Vertex AI Claude
-            response = st.session_state.vertex_claude.chat(
-                user_input,
-                context=context,
-                conversation_history=st.session_state.messages
-            )
+            # Only stand-alone questions are answered from the semantic cache;
+            # follow-ups depend on the conversation around them
+            embedding = None
+            cached_response = None
+            if not st.session_state.model_history:
+                embedding = semantic_cache.embed(user_input)
+            if embedding is not None:
+                cached_response = semantic_cache.lookup(st.session_state.current_project, embedding, context)
             
+        
+        if cached_response is not None:
+            response = cached_response
             st.markdown(response)
-            st.session_state.messages.append({"role": "assistant", "content": response})
-            
-            # Save conversation to Firestore
-            st.session_state.context_manager.save_conversation(
-                project=st.session_state.current_project,
-                messages=st.session_state.messages
-            )
+        else:
+            # Route to Vertex AI Claude, rendering tokens as they arrive
+            try:
+                response = st.write_stream(st.session_state.vertex_claude.chat_stream(
+                    user_input,
+                    context=context,
+                    conversation_history=st.session_state.model_history
+                ))
+            except ChatError as e:
+                # Keep whatever arrived before the failure, followed by the error
+                st.markdown(str(e))
+                response = e.partial + str(e)
+            else:
+                # Only complete answers are reused
+                if embedding is not None:
+                    semantic_cache.store(st.session_state.current_project, user_input, embedding, response, context)
+        
+        st.session_state.messages.append(Msg(role="assistant", content=response))
+        st.session_state.model_history.extend(st.session_state.messages[-2:])
+        
+        # Save conversation to Firestore
+        st.session_state.context_manager.save_conversation(
+            project=st.session_state.current_project,
+            messages=st.session_state.messages
+        )
+
+# Usage for this browser session, now that any request in this run has finished
+usage_placeholder.markdown(f"""
+<div class='usage-stat'>
+    <span>Total Cost:</span>
+    <span style='color: #10b981;'>${st.session_state.vertex_claude.total_cost:.4f}</span>
+</div>
+<div class='usage-stat'>
+    <span>Requests:</span>
+    <span>{st.session_state.vertex_claude.total_requests}</span>
+</div>
+<div class='usage-stat'>
+    <span>Model:</span>
+    <span>Sonnet 4</span>
+</div>
+""", unsafe_allow_html=True)
 
 # Footer tip
 st.markdown("---")
@@ -0,0 +1,11 @@
+#!/usr/bin/env python3
+"""
+CHAT TYPES - One message type for the chat view, the model prompt and Firestore
+"""
+
+from dataclasses import dataclass
+
+@dataclass(slots=True)
+class Msg:
+    role: str
+    content: str
@@ -4,49 +4,421 @@ CONTEXT MANAGER - Persistent state in Firestore
 Remembers everything so you never start over
 """
 
-from google.cloud import firestore
-from datetime import datetime
-from typing import Dict, List
+import streamlit as st
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Dict, List, Optional
+from dataclasses import asdict
+from chat_types import Msg
+import atexit
+import functools
+import json
+import math
 import os
+import queue
+import sqlite3
+import threading
+import time
+import uuid
+import weakref
+import zstandard as zstd
+from collections import Counter, deque
+from concurrent.futures import ThreadPoolExecutor
+
+if TYPE_CHECKING:
+    from google.api_core.retry import Retry
+    from google.cloud import firestore
+
+# Queued conversation messages are flushed every 500ms, or as soon as 50 pile up
+FLUSH_INTERVAL_SECONDS = 0.5
+FLUSH_MAX_MESSAGES = 50
+# A flush failing with a transient error is retried with capped exponential
+# backoff; after 5 failures in a row its messages are dropped
+FLUSH_MAX_ATTEMPTS = 5
+FLUSH_RETRY_MAX_SECONDS = 30.0
+# Execution logs are flushed every 2 seconds, or as soon as 400 pile up;
+# past 10k unflushed logs new ones are dropped rather than blocking callers
+EXEC_FLUSH_INTERVAL_SECONDS = 2.0
+EXEC_FLUSH_MAX = 400
+EXEC_QUEUE_MAX = 10_000
+# Message content at least this long is stored zstd-compressed; shorter text
+# barely shrinks and isn't worth the decode
+COMPRESS_MIN_CHARS = 512
+# Firestore rejects WriteBatches with more than 500 operations
+BATCH_LIMIT = 500
+# Most values one 'in' filter may list
+IN_QUERY_LIMIT = 10
+
+# Project context survives process restarts in a local SQLite file for 5 minutes
+CONTEXT_DISK_PATH = os.getenv('CONTEXT_CACHE_DB', '/tmp/ctx_cache.db')
+CONTEXT_TTL_SECONDS = 300
+# Most project contexts kept in memory; least recently used ones are evicted
+_CACHE_MAX = 512
+
+# Background writers so chat turns never wait on Firestore
+_WRITE_EXECUTOR = ThreadPoolExecutor(max_workers=2, thread_name_prefix='firestore-writer')
+
+# Context managers that may hold unflushed conversation messages; weak, so
+# sessions that end are not kept alive until exit
+_CONVERSATION_WRITERS = weakref.WeakSet()
+
+
+def _flush_conversations_at_exit():
+    """
+    Write every session's queued messages before the process exits
+    The write executor is already shut down by now, so this flushes inline
+    """
+    for context_manager in list(_CONVERSATION_WRITERS):
+        context_manager._flush_conversations()
+
+
+atexit.register(_flush_conversations_at_exit)
+
+
+@functools.lru_cache(maxsize=None)
+def _transient_errors() -> tuple:
+    """
+    Firestore errors worth retrying: the request may succeed if simply sent again
+    Looked up on first use, since google.api_core pulls in gRPC
+    """
+    from google.api_core import exceptions as gax
+    return (
+        gax.DeadlineExceeded,
+        gax.InternalServerError,
+        gax.ServiceUnavailable,
+        gax.TooManyRequests,
+        gax.ResourceExhausted
+    )
+
+
+@functools.lru_cache(maxsize=None)
+def _firestore_retry() -> 'Retry':
+    """
+    Exponential backoff on transient errors (DeadlineExceeded, Unavailable, ...)
+    for idempotent Firestore reads and sets, so blips never reach the user
+    """
+    from google.api_core.retry import Retry, if_exception_type
+    return Retry(
+        predicate=if_exception_type(*_transient_errors()),
+        initial=0.1,
+        maximum=2.0,
+        multiplier=2.0,
+        deadline=30.0
+    )
+
+
+@st.cache_resource
+def _get_firestore_client(project_id: str) -> 'firestore.Client':
+    """
+    One Firestore client per process, shared across sessions and reruns
+    """
+    from google.cloud import firestore
+    return firestore.Client(project=project_id)
+
+
+class _DiskCache:
+    """
+    Key/value cache in SQLite (WAL mode) shared by every session in the process
+    """
+    def __init__(self, path: str):
+        self._conn = sqlite3.connect(path, isolation_level=None, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('CREATE TABLE IF NOT EXISTS ctx(k TEXT PRIMARY KEY, v BLOB, exp REAL)')
+        self._lock = threading.Lock()
+    
+    def get(self, key: str) -> Optional[tuple]:
+        """
+        (value, expiry time) for a live row, None once it has expired
+        """
+        with self._lock:
+            row = self._conn.execute('SELECT v, exp FROM ctx WHERE k=?', (key,)).fetchone()
+        if row and row[1] > time.time():
+            return json.loads(row[0]), row[1]
+        return None
+    
+    def set(self, key: str, value: Dict, ttl: float):
+        # Timestamps are stored as their string form, which is how prompts render them
+        blob = json.dumps(value, default=str).encode()
+        with self._lock:
+            self._conn.execute('INSERT OR REPLACE INTO ctx VALUES(?, ?, ?)', (key, blob, time.time() + ttl))
+    
+    def delete(self, key: str):
+        with self._lock:
+            self._conn.execute('DELETE FROM ctx WHERE k=?', (key,))
+
+
+@st.cache_resource
+def _get_disk_cache() -> Optional[_DiskCache]:
+    try:
+        return _DiskCache(CONTEXT_DISK_PATH)
+    except sqlite3.Error as e:
+        print(f"Context disk cache error: {e}")
+        return None
+
+
+# Bumped when a memory entry outlives the disk row it came from, so the next
+# call misses the memory tier (st.cache_data can't expire a single entry)
+_CONTEXT_GENERATIONS: Dict[str, int] = {}
+
+
+@st.cache_data(ttl=CONTEXT_TTL_SECONDS, max_entries=_CACHE_MAX)
+def _fetch_project_context(project_id: str, doc_id: str, generation: int = 0) -> tuple:
+    """
+    (context, expiry time) for a project document, read through the disk cache
+    """
+    disk = _get_disk_cache()
+    if disk:
+        cached = disk.get(f"{project_id}/{doc_id}")
+        if cached is not None:
+            return cached
+    
+    project_ref = _get_firestore_client(project_id).collection('projects').document(doc_id)
+    project_doc = project_ref.get(retry=_firestore_retry())
+    
+    context = project_doc.to_dict() if project_doc.exists else {}
+    if disk and project_doc.exists:
+        disk.set(f"{project_id}/{doc_id}", context, CONTEXT_TTL_SECONDS)
+    return context, time.time() + CONTEXT_TTL_SECONDS
+
+
+def _project_context(project_id: str, doc_id: str) -> Dict:
+    """
+    Project documents rarely change, so reads are served from cache for 5 minutes,
+    first from memory, then from the local disk cache; an entry promoted from disk
+    lives only as long as the disk row had left
+    """
+    key = f"{project_id}/{doc_id}"
+    context, expires = _fetch_project_context(project_id, doc_id, _CONTEXT_GENERATIONS.get(key, 0))
+    if expires <= time.time():
+        _CONTEXT_GENERATIONS[key] = _CONTEXT_GENERATIONS.get(key, 0) + 1
+        context, _ = _fetch_project_context(project_id, doc_id, _CONTEXT_GENERATIONS[key])
+    return context
+
+
+class _ProjectWatch:
+    """
+    Live copy of the projects collection, pushed over one Firestore listener
+    """
+    def __init__(self, db: 'firestore.Client'):
+        self.projects: Dict[str, Dict] = {}
+        self._watch = db.collection('projects').on_snapshot(self._on_snapshot)
+    
+    def _on_snapshot(self, collection_snapshot, changes, read_time):
+        # Runs on the listener's thread; documents are replaced whole, never mutated
+        for change in changes:
+            if change.type.name == 'REMOVED':
+                self.projects.pop(change.document.id, None)
+            else:
+                self.projects[change.document.id] = change.document.to_dict()
+    
+    @property
+    def is_active(self) -> bool:
+        # The listener closes for good on unrecoverable stream errors
+        return self._watch.is_active
+
+
+@st.cache_resource
+def _watch_projects(project_id: str) -> _ProjectWatch:
+    """
+    One project listener per process; its stream and thread stay up while it is healthy
+    """
+    return _ProjectWatch(_get_firestore_client(project_id))
+
+
+def _commit_batched(db: 'firestore.Client', writes: List[tuple]):
+    """
+    Commit (document ref, data[, merge]) sets in as few WriteBatches as Firestore allows
+    """
+    for offset in range(0, len(writes), BATCH_LIMIT):
+        batch = db.batch()
+        for ref, data, *merge in writes[offset:offset + BATCH_LIMIT]:
+            batch.set(ref, data, merge=bool(merge and merge[0]))
+        batch.commit(retry=_firestore_retry())
+
+
+def _daily_stats_ref(db: 'firestore.Client', project: str, day: str):
+    return db.collection('stats').document(ContextManager._slug(project)).collection('daily').document(day)
+
+
+class _ExecutionLogWriter:
+    """
+    Execution logs queued by every session in the process, committed together
+    with their daily rollups from one long-lived drainer thread
+    """
+    def __init__(self, db: 'firestore.Client'):
+        from google.cloud import firestore
+        self._fs = firestore
+        self._db = db
+        
+        # (document ref, data), or None to make the drainer commit what it holds and stop
+        self._queue = queue.Queue(maxsize=EXEC_QUEUE_MAX)
+        self._drainer = threading.Thread(target=self._drain, name='execution-log-drainer', daemon=True)
+        self._drainer.start()
+        atexit.register(self._stop)
+    
+    def put(self, execution_ref, execution_data: Dict) -> bool:
+        """
+        Queue an execution log; returns False if the queue is full
+        """
+        try:
+            self._queue.put_nowait((execution_ref, execution_data))
+        except queue.Full:
+            return False
+        return True
+    
+    def _drain(self):
+        while True:
+            entry = self._queue.get()
+            if entry is None:
+                return
+            
+            writes = [entry]
+            deadline = time.monotonic() + EXEC_FLUSH_INTERVAL_SECONDS
+            while len(writes) < EXEC_FLUSH_MAX:
+                try:
+                    entry = self._queue.get(timeout=max(0, deadline - time.monotonic()))
+                except queue.Empty:
+                    break
+                if entry is None:
+                    self._commit(writes)
+                    return
+                writes.append(entry)
+            
+            self._commit(writes)
+    
+    def _stop(self):
+        """
+        Let the drainer commit everything still queued before the process exits
+        """
+        try:
+            self._queue.put(None, timeout=5)
+        except queue.Full:
+            pass
+        self._drainer.join(timeout=30)
+    
+    def _commit(self, writes: List[tuple]):
+        # Split so every chunk's logs and rollups fit one WriteBatch together
+        chunk, days = [], set()
+        for entry in writes:
+            day = (ContextManager._slug(entry[1]['project']), entry[1]['day'])
+            if len(chunk) + 1 + len(days | {day}) > BATCH_LIMIT:
+                self._commit_chunk(chunk)
+                chunk, days = [], set()
+            chunk.append(entry)
+            days.add(day)
+        if chunk:
+            self._commit_chunk(chunk)
+    
+    def _commit_chunk(self, writes: List[tuple]):
+        # Fold the chunk into per-project daily rollups, one merge write per day;
+        # keyed by slug, the rollup document's id, so name spellings share a rollup
+        rollups = {}
+        for _, data in writes:
+            rollup = rollups.setdefault(
+                (ContextManager._slug(data['project']), data['day']),
+                {'project': data['project'], 'requests': 0, 'cost': 0.0, 'actions': {}}
+            )
+            rollup['requests'] += 1
+            rollup['cost'] += data['cost']
+            rollup['actions'][data['action']] = rollup['actions'].get(data['action'], 0) + 1
+        
+        batch = self._db.batch()
+        for ref, data in writes:
+            batch.set(ref, data)
+        for (slug, day), rollup in rollups.items():
+            batch.set(_daily_stats_ref(self._db, rollup['project'], day), {
+                'project': rollup['project'],
+                'slug': slug,
+                'day': day,
+                'total_requests': self._fs.Increment(rollup['requests']),
+                'total_cost': self._fs.Increment(rollup['cost']),
+                'actions': {action: self._fs.Increment(count) for action, count in rollup['actions'].items()}
+            }, merge=True)
+        
+        # Not retried: an Increment commit that timed out may still have been
+        # applied, and retrying it would count the chunk twice
+        try:
+            batch.commit(retry=None)
+        except Exception as e:
+            print(f"Firestore execution log error: {e}")
+
+
+@st.cache_resource
+def _get_execution_log_writer(project_id: str) -> _ExecutionLogWriter:
+    """
+    One execution log queue and drainer per process, shared by every session
+    """
+    return _ExecutionLogWriter(_get_firestore_client(project_id))
+
 
 class ContextManager:
     def __init__(self):
         self.project_id = os.getenv('GCP_PROJECT_ID')
         
+        # Firestore (and its gRPC stack) is only imported once a project is configured
+        self._fs = None
         if self.project_id:
             try:
-                self.db = firestore.Client(project=self.project_id)
+                from google.cloud import firestore
+                self._fs = firestore
+                self.db = _get_firestore_client(self.project_id)
             except Exception as e:
                 print(f"Firestore init error: {e}")
                 self.db = None
         else:
             self.db = None
         
+        # Conversation persistence: messages handed to the writer per conversation,
+        # and the (project, seq, message) entries still waiting to be flushed.
+        # Messages are stored under this session's id, so two tabs on the same
+        # project never overwrite each other's positions
+        self.session_id = uuid.uuid4().hex
+        self._queued_counts: Dict[str, int] = {}
+        self._queued_tails: Dict[str, Msg] = {}
+        self._pending = deque()
+        self._save_timer = None
+        self._flush_failures = 0
+        self._save_lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        # Only used by the flush, which _flush_lock keeps single-threaded
+        self._zc = zstd.ZstdCompressor(level=3)
+        
+        # Execution logs go to the process-wide writer
+        self._exec_log = None
+        
         # Initialize mission context if needed
         if self.db:
             self._initialize_mission_context()
+            self._exec_log = _get_execution_log_writer(self.project_id)
+            try:
+                # Start syncing project documents before the first question
+                _watch_projects(self.project_id)
+            except Exception as e:
+                print(f"Firestore listener error: {e}")
+    
+    @staticmethod
+    @functools.lru_cache(maxsize=256)
+    def _slug(project_name: str) -> str:
+        """
+        Firestore document id for a project name
+        """
+        return project_name.strip().lower().replace(' ', '_')
     
     def _initialize_mission_context(self):
         """
         Initialize 90-day mission context in Firestore
         """
-        mission_ref = self.db.collection('mission').document('bootstrap')
-        
-        # Check if already initialized
-        if not mission_ref.get().exists:
-            mission_data = {
-                'start_date': '2025-10-17',
-                'deadline': '2026-01-15',
-                'goal_revenue': 15000,
-                'primary_stream': 'HAVEN Platform',
-                'secondary_stream': 'TBD',
-                'tertiary_stream': 'TBD',
-                'founder': 'James',
-                'co_founder': 'Claude',
-                'philosophy': 'Ship fast, iterate, delegate to agents',
-                'created_at': firestore.SERVER_TIMESTAMP
-            }
-            mission_ref.set(mission_data)
+        mission_data = {
+            'start_date': '2025-10-17',
+            'deadline': '2026-01-15',
+            'goal_revenue': 15000,
+            'primary_stream': 'HAVEN Platform',
+            'secondary_stream': 'TBD',
+            'tertiary_stream': 'TBD',
+            'founder': 'James',
+            'co_founder': 'Claude',
+            'philosophy': 'Ship fast, iterate, delegate to agents',
+            'created_at': self._fs.SERVER_TIMESTAMP
+        }
         
         # Initialize project contexts
         projects = {
@@ -70,11 +442,37 @@ class ContextManager:
             }
         }
         
+        seed = [(self.db.collection('mission').document('bootstrap'), mission_data)]
         for project_name, project_data in projects.items():
-            project_ref = self.db.collection('projects').document(project_name.lower().replace(' ', '_'))
-            if not project_ref.get().exists:
-                project_data['created_at'] = firestore.SERVER_TIMESTAMP
-                project_ref.set(project_data)
+            project_ref = self.db.collection('projects').document(self._slug(project_name))
+            seed.append((project_ref, {**project_data, 'created_at': self._fs.SERVER_TIMESTAMP}))
+        
+        # One multi-get for every existence check, one commit for whatever is missing;
+        # the field mask keeps existing document bodies off the wire
+        snapshots = self.db.get_all(
+            [ref for ref, _ in seed],
+            field_paths=['created_at'],
+            retry=_firestore_retry()
+        )
+        existing = {snapshot.reference.path for snapshot in snapshots if snapshot.exists}
+        missing = [(ref, data) for ref, data in seed if ref.path not in existing]
+        if not missing:
+            return
+        
+        # create() never overwrites, so a concurrent bootstrap can't clobber
+        # a document another instance seeded (or updated) since our read
+        from google.api_core.exceptions import AlreadyExists
+        try:
+            batch = self.db.batch()
+            for ref, data in missing:
+                batch.create(ref, data)
+            batch.commit(retry=_firestore_retry())
+        except AlreadyExists:
+            for ref, data in missing:
+                try:
+                    ref.create(data, retry=_firestore_retry())
+                except AlreadyExists:
+                    pass
     
     def get_project_context(self, project_name: str) -> Dict:
         """
@@ -83,45 +481,212 @@ class ContextManager:
         if not self.db:
             return {}
         
-        doc_id = project_name.lower().replace(' ', '_')
-        project_ref = self.db.collection('projects').document(doc_id)
-        project_doc = project_ref.get()
+        doc_id = self._slug(project_name)
         
-        if project_doc.exists:
-            return project_doc.to_dict()
-        return {}
+        try:
+            watch = _watch_projects(self.project_id)
+        except Exception as e:
+            print(f"Firestore listener error: {e}")
+            watch = None
+        
+        # Served from the listener's copy; fall back to a read until it has synced,
+        # or once it has died (a new listener is opened on the next call)
+        if watch and watch.is_active:
+            context = watch.projects.get(doc_id)
+            if context is not None:
+                return dict(context)
+        elif watch:
+            _watch_projects.clear()
+        return _project_context(self.project_id, doc_id)
     
-    def save_conversation(self, project: str, messages: List[Dict]):
+    def save_conversation(self, project: str, messages: List[Msg]):
         """
         Save conversation to Firestore for persistence
+        Only messages added since the last save are queued; a background
+        writer commits them, so this returns immediately
         """
         if not self.db:
             return
         
-        doc_id = project.lower().replace(' ', '_')
-        conversation_ref = self.db.collection('conversations').document(doc_id)
+        doc_id = self._slug(project)
         
-        conversation_ref.set({
-            'project': project,
-            'messages': messages,
-            'last_updated': firestore.SERVER_TIMESTAMP,
-            'message_count': len(messages)
-        })
+        with self._save_lock:
+            # A cleared chat starts a fresh list, so the last queued message is no
+            # longer at its old position; rewrite the conversation from the top
+            start = self._queued_counts.get(doc_id, 0)
+            if start > len(messages) or (start and messages[start - 1] is not self._queued_tails.get(doc_id)):
+                start = 0
+            
+            self._pending.extend((project, seq, message) for seq, message in enumerate(messages[start:], start))
+            self._queued_counts[doc_id] = len(messages)
+            self._queued_tails[doc_id] = messages[-1] if messages else None
+            _CONVERSATION_WRITERS.add(self)
+            self._schedule_flush()
+    
+    def _schedule_flush(self, delay: float = None):
+        """
+        Flush now if enough messages are queued, otherwise after the interval;
+        while retrying a failed flush, wait out the backoff delay instead
+        Called with _save_lock held
+        """
+        if delay is not None:
+            if self._save_timer:
+                self._save_timer.cancel()
+            self._start_flush_timer(delay)
+        elif len(self._pending) >= FLUSH_MAX_MESSAGES and not self._flush_failures:
+            if self._save_timer:
+                self._save_timer.cancel()
+                self._save_timer = None
+            self._submit_flush()
+        elif not self._save_timer:
+            self._start_flush_timer(FLUSH_INTERVAL_SECONDS)
+    
+    def _start_flush_timer(self, delay: float):
+        # Daemon, so a pending debounce never holds up exit; the atexit flush covers it
+        self._save_timer = threading.Timer(delay, self._submit_flush)
+        self._save_timer.daemon = True
+        self._save_timer.start()
+    
+    def _submit_flush(self):
+        try:
+            _WRITE_EXECUTOR.submit(self._flush_conversations)
+        except RuntimeError:
+            # The executor has shut down for exit; the atexit flush writes these
+            pass
     
-    def get_last_conversation(self, project: str) -> List[Dict]:
+    def _flush_conversations(self):
+        """
+        Write queued conversation messages, one document per message
+        """
+        with self._flush_lock:
+            with self._save_lock:
+                pending = list(self._pending)
+                self._pending.clear()
+                self._save_timer = None
+                message_counts = dict(self._queued_counts)
+            
+            if not pending:
+                return
+            
+            # One client-side timestamp for the whole flush instead of a
+            # server-timestamp transform on every document
+            flushed_at = datetime.now(timezone.utc)
+            
+            # Later entries for the same position win (e.g. after a cleared chat)
+            writes = {}
+            for project, seq, message in pending:
+                doc_id = self._slug(project)
+                conversation_ref = self.db.collection('conversations').document(doc_id)
+                session_ref = conversation_ref.collection('sessions').document(self.session_id)
+                message_ref = session_ref.collection('messages').document(f"{seq:06d}")
+                writes[message_ref.path] = (message_ref, {**self._encode_message(message), 'seq': seq, 'ts': flushed_at})
+                # The project's last conversation is whichever session saved most recently
+                writes[conversation_ref.path] = (conversation_ref, {
+                    'project': project,
+                    'session': self.session_id,
+                    'last_updated': flushed_at,
+                    'message_count': message_counts[doc_id]
+                })
+            
+            try:
+                _commit_batched(self.db, list(writes.values()))
+            except Exception as e:
+                with self._save_lock:
+                    self._flush_failed(pending, e)
+                return
+            
+            with self._save_lock:
+                self._flush_failures = 0
+    
+    def _flush_failed(self, pending: List[tuple], error: Exception):
+        """
+        Requeue a failed flush for a backed-off retry if the error is transient,
+        otherwise (or once retries run out) drop it
+        Called with _save_lock held
+        """
+        self._flush_failures += 1
+        transient = isinstance(error, _transient_errors())
+        
+        if transient and self._flush_failures < FLUSH_MAX_ATTEMPTS:
+            delay = min(FLUSH_RETRY_MAX_SECONDS, FLUSH_INTERVAL_SECONDS * 2 ** self._flush_failures)
+            print(f"Firestore save error, retrying in {delay:.1f}s: {error}")
+            # The saved position has already moved past these messages, so put
+            # them back ahead of anything queued since
+            self._pending.extendleft(reversed(pending))
+            self._schedule_flush(delay)
+            return
+        
+        print(f"Firestore save error, dropping {len(pending)} messages: {error}")
+        self._flush_failures = 0
+        if transient:
+            # Nothing is wrong with the messages themselves, so the next save
+            # rewrites these conversations from the top instead of leaving gaps
+            for project in {project for project, _, _ in pending}:
+                self._queued_counts.pop(self._slug(project), None)
+                self._queued_tails.pop(self._slug(project), None)
+        if self._pending:
+            self._schedule_flush()
+    
+    def _encode_message(self, message: Msg) -> Dict:
+        """
+        Message document fields, with long content compressed into content_z
+        """
+        if len(message.content) < COMPRESS_MIN_CHARS:
+            return asdict(message)
+        return {'role': message.role, 'content_z': self._zc.compress(message.content.encode())}
+    
+    def get_last_conversation(self, project: str, limit: int = None) -> List[Msg]:
         """
         Retrieve last conversation for a project
+        With limit, only the most recent messages are read
         """
         if not self.db:
             return []
         
-        doc_id = project.lower().replace(' ', '_')
+        doc_id = self._slug(project)
         conversation_ref = self.db.collection('conversations').document(doc_id)
-        conversation_doc = conversation_ref.get()
+        conversation_doc = conversation_ref.get(retry=_firestore_retry())
+        
+        if not conversation_doc.exists:
+            return []
         
-        if conversation_doc.exists:
-            return conversation_doc.to_dict().get('messages', [])
-        return []
+        conversation = conversation_doc.to_dict()
+        if 'messages' in conversation:
+            # Legacy schema: whole conversation stored as one array
+            legacy = conversation['messages'][-limit:] if limit else conversation['messages']
+            return [Msg(role=m['role'], content=m['content']) for m in legacy]
+        
+        # Documents past message_count are left over from a longer, cleared chat
+        message_count = conversation.get('message_count', 0)
+        if not message_count:
+            return []
+        
+        # Conversations saved before sessions were tracked keep their messages directly below
+        if 'session' in conversation:
+            messages_ref = conversation_ref.collection('sessions').document(conversation['session']).collection('messages')
+        else:
+            messages_ref = conversation_ref.collection('messages')
+        
+        query = (
+            messages_ref
+            .where(filter=self._fs.FieldFilter('seq', '<', message_count))
+            .order_by('seq', direction=self._fs.Query.DESCENDING)
+        )
+        if limit:
+            query = query.limit(limit)
+        
+        # Decompressors aren't thread-safe, so each read gets its own
+        zd = zstd.ZstdDecompressor()
+        messages = []
+        for message_doc in query.stream(retry=_firestore_retry()):
+            message = message_doc.to_dict()
+            if 'content_z' in message:
+                content = zd.decompress(message['content_z']).decode()
+            else:
+                content = message['content']
+            messages.append(Msg(role=message['role'], content=content))
+        messages.reverse()
+        return messages
     
     def update_project_status(self, project: str, status: str, updates: Dict = None):
         """
@@ -130,31 +695,136 @@ class ContextManager:
         if not self.db:
             return
         
-        doc_id = project.lower().replace(' ', '_')
+        doc_id = self._slug(project)
         project_ref = self.db.collection('projects').document(doc_id)
         
         update_data = {
             'status': status,
-            'last_updated': firestore.SERVER_TIMESTAMP
+            'last_updated': self._fs.SERVER_TIMESTAMP
         }
         
         if updates:
             update_data.update(updates)
         
-        project_ref.update(update_data)
+        project_ref.update(update_data, retry=_firestore_retry())
+        _fetch_project_context.clear()
+        disk = _get_disk_cache()
+        if disk:
+            disk.delete(f"{self.project_id}/{doc_id}")
     
-    def log_execution(self, project: str, action: str, result: str, cost: float = 0):
+    def log_execution(self, project: str, action: str, result: str, cost: float = 0) -> bool:
         """
         Log execution for tracking and cost monitoring
+        Queued for the background drainer; returns False if it had to be dropped
         """
         if not self.db:
-            return
+            return False
         
         execution_ref = self.db.collection('executions').document()
-        execution_ref.set({
+        execution_data = {
             'project': project,
             'action': action,
             'result': result,
             'cost': cost,
-            'timestamp': firestore.SERVER_TIMESTAMP
-        })
\ No newline at end of file
+            'day': datetime.now(timezone.utc).strftime('%Y-%m-%d'),
+            'timestamp': self._fs.SERVER_TIMESTAMP
+        }
+        
+        if not self._exec_log.put(execution_ref, execution_data):
+            print(f"Execution log queue full, dropping {action} for {project}")
+            return False
+        return True
+    
+    def get_usage_stats(self, project: str = None, days: int = 1, from_logs: bool = False) -> Dict:
+        """
+        Get cost, request and per-action totals for the last `days` UTC calendar days (today included)
+        Read from the daily rollups log_execution maintains; from_logs recomputes
+        them from raw executions instead (e.g. for history predating the rollups)
+        """
+        day_ids = self._usage_days(days)
+        stats = {'total_cost': 0.0, 'total_requests': 0, 'actions': {}}
+        if not self.db:
+            return stats
+        
+        if from_logs:
+            return self._usage_stats_from_logs(project, day_ids[-1])
+        
+        if project:
+            day_docs = self.db.get_all(
+                [_daily_stats_ref(self.db, project, day) for day in day_ids], retry=_firestore_retry()
+            )
+        else:
+            day_docs = (
+                self.db.collection_group('daily')
+                .where(filter=self._fs.FieldFilter('day', '>=', day_ids[-1]))
+                .stream(retry=_firestore_retry())
+            )
+        
+        for day_doc in day_docs:
+            if day_doc.exists:
+                self._add_daily_stats(stats, day_doc.to_dict())
+        
+        return stats
+    
+    def get_usage_stats_all(self, projects: List[str], days: int = 1) -> Dict[str, Dict]:
+        """
+        get_usage_stats for several projects at once, keyed by the given names
+        One rollup query per IN_QUERY_LIMIT projects instead of one read per project
+        """
+        first_day = self._usage_days(days)[-1]
+        all_stats = {project: {'total_cost': 0.0, 'total_requests': 0, 'actions': {}} for project in projects}
+        if not self.db or not projects:
+            return all_stats
+        
+        # Matched by slug like get_usage_stats, so any spelling of a name finds its rollups
+        names_by_slug: Dict[str, List[str]] = {}
+        for project in all_stats:
+            names_by_slug.setdefault(self._slug(project), []).append(project)
+        slugs = list(names_by_slug)
+        
+        for i in range(0, len(slugs), IN_QUERY_LIMIT):
+            query = (
+                self.db.collection_group('daily')
+                .where(filter=self._fs.FieldFilter('day', '>=', first_day))
+                .where(filter=self._fs.FieldFilter('slug', 'in', slugs[i:i + IN_QUERY_LIMIT]))
+            )
+            for day_doc in query.stream(retry=_firestore_retry()):
+                day_stats = day_doc.to_dict()
+                for project in names_by_slug[day_stats['slug']]:
+                    self._add_daily_stats(all_stats[project], day_stats)
+        
+        return all_stats
+    
+    def _usage_days(self, days: int) -> List[str]:
+        """
+        Ids of the last `days` UTC calendar days, today first
+        """
+        if days < 1:
+            raise ValueError(f"days must be at least 1, got {days}")
+        today = datetime.now(timezone.utc).date()
+        return [(today - timedelta(days=n)).strftime('%Y-%m-%d') for n in range(days)]
+    
+    def _add_daily_stats(self, stats: Dict, day_stats: Dict):
+        stats['total_cost'] += day_stats.get('total_cost', 0)
+        stats['total_requests'] += day_stats.get('total_requests', 0)
+        for action, count in day_stats.get('actions', {}).items():
+            stats['actions'][action] = stats['actions'].get(action, 0) + count
+    
+    def _usage_stats_from_logs(self, project: str, first_day: str) -> Dict:
+        # Midnight UTC of the first day, so both paths cover the same calendar days
+        threshold = datetime.strptime(first_day, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        query = self.db.collection('executions').where(filter=self._fs.FieldFilter('timestamp', '>=', threshold))
+        if project:
+            query = query.where(filter=self._fs.FieldFilter('project', '==', project))
+        
+        # The histogram needs every execution anyway, so totals come from the same scan;
+        # only cost and action are downloaded, not the result text
+        actions = Counter()
+        costs = []
+        for exec_doc in query.select(['cost', 'action']).stream(retry=_firestore_retry()):
+            data = exec_doc.to_dict()
+            costs.append(data.get('cost', 0))
+            actions[data.get('action', 'unknown')] += 1
+        
+        # fsum keeps thousands of small per-request costs from drifting
+        return {'total_cost': math.fsum(costs), 'total_requests': len(costs), 'actions': dict(actions)}
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+SEMANTIC CACHE - Answers near-duplicate project questions without calling Claude
+"What's the status?" asked twice only costs one generation
+"""
+
+from vertex_claude import init_vertex
+from collections import OrderedDict
+from typing import Dict, Optional, Tuple
+import numpy as np
+import os
+import threading
+
+# Cosine similarity a question needs to reuse a cached answer
+SIMILARITY_THRESHOLD = 0.95
+# Least recently used answers are evicted past this many per project
+MAX_ENTRIES_PER_PROJECT = 1000
+
+class SemanticCache:
+    def __init__(self):
+        self.project_id = os.getenv('GCP_PROJECT_ID')
+        self.location = os.getenv('GCP_REGION', 'us-central1')
+        
+        self.model = None
+        if self.project_id:
+            # The cache is optional; without embeddings every question just goes to Claude
+            try:
+                from vertexai.language_models import TextEmbeddingModel
+                init_vertex(self.project_id, self.location)
+                self.model = TextEmbeddingModel.from_pretrained("text-embedding-004")
+            except Exception as e:
+                print(f"Embedding model init error: {e}")
+        
+        # Per project: the context the answers were generated with, and
+        # question -> (unit-length embedding, response), oldest first
+        self._entries: Dict[str, Tuple[str, OrderedDict]] = {}
+        self._lock = threading.Lock()
+    
+    def _project_entries(self, project: str, context: Dict) -> OrderedDict:
+        """
+        Cached answers for a project, dropped once its context has changed
+        (e.g. after a status update), since every answer embeds the old one
+        Called with _lock held
+        """
+        context_key = repr(sorted(context.items())) if context else ""
+        cached = self._entries.get(project)
+        if cached is None or cached[0] != context_key:
+            cached = self._entries[project] = (context_key, OrderedDict())
+        return cached[1]
+    
+    def embed(self, text: str) -> Optional[np.ndarray]:
+        """
+        Embed a question, normalized so cosine similarity is a dot product
+        """
+        if not self.model:
+            return None
+        
+        try:
+            values = self.model.get_embeddings([text])[0].values
+        except Exception as e:
+            print(f"Embedding error: {e}")
+            return None
+        
+        embedding = np.asarray(values, dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+    
+    def lookup(self, project: str, embedding: np.ndarray, context: Dict = None) -> Optional[str]:
+        """
+        Get the cached response for the most similar question, if similar enough
+        and answered under the same project context
+        """
+        with self._lock:
+            entries = self._project_entries(project, context)
+            if not entries:
+                return None
+            
+            best_question, best_score = None, SIMILARITY_THRESHOLD
+            for question, (cached_embedding, _) in entries.items():
+                score = float(np.dot(embedding, cached_embedding))
+                if score >= best_score:
+                    best_question, best_score = question, score
+            
+            if best_question is None:
+                return None
+            
+            entries.move_to_end(best_question)
+            return entries[best_question][1]
+    
+    def store(self, project: str, question: str, embedding: np.ndarray, response: str, context: Dict = None):
+        """
+        Cache a response for a project question, answered under the given context
+        """
+        with self._lock:
+            entries = self._project_entries(project, context)
+            entries[question] = (embedding, response)
+            entries.move_to_end(question)
+            while len(entries) > MAX_ENTRIES_PER_PROJECT:
+                entries.popitem(last=False)
\ No newline at end of file
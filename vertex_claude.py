@@ -3,88 +3,293 @@
 VERTEX CLAUDE - Routes to Claude via Vertex AI (uses YOUR GCP credits)
 """
 
-import vertexai
-from vertexai.preview.generative_models import GenerativeModel
+import asyncio
+import functools
+from collections import OrderedDict
 import os
-from typing import List, Dict
+import random
+import threading
+import time
+from typing import TYPE_CHECKING, List, Dict, Iterator, Sequence
+from chat_types import Msg
+
+if TYPE_CHECKING:
+    from vertexai.preview.generative_models import GenerativeModel
+
+# Most recent messages sent to the model
+MAX_TURNS = 10
+
+# Generation attempts before a transient Vertex AI error is shown to the user
+MAX_ATTEMPTS = 3
+
+# How long a health_check result is served before the endpoint is probed again
+HEALTH_CHECK_TTL_SECONDS = 30
+
+NOT_CONFIGURED_MESSAGE = "❌ Vertex AI not configured. Set GCP_PROJECT_ID environment variable."
+
+# Distinct project contexts whose system prompt is kept built
+PROMPT_CACHE_MAX = 32
+# Speaker prefixes for history lines, so common roles skip upper() per turn
+_ROLE_LABELS = {'user': "USER: ", 'assistant': "ASSISTANT: "}
+
+_BASE_PROMPT = """You are Claude, technical co-founder of a 90-day bootstrap mission to $15K/month.
+
+MISSION CONTEXT:
+- Founder: James (vision/vibe) + You (technical/execution)
+- Timeline: Oct 17, 2025 → Jan 15, 2026 (90 days)
+- Goal: $15K monthly recurring revenue
+- Primary Revenue: HAVEN Platform (community/service hub)
+- HQ: This Valhalla interface + GCP infrastructure
+- Philosophy: Ship fast, iterate, delegate to agents
+"""
+
+_PROMPT_FOOTER = """
+You have full access to GCP infrastructure. When James asks you to build something:
+1. Design the architecture
+2. Generate the code
+3. Explain deployment steps
+4. Help execute via GCP services
+
+Be direct, technical, and action-oriented. No fluff."""
+
+class ChatError(Exception):
+    """
+    A request that failed, possibly after part of the answer was streamed
+    The message is the user-facing error text; partial is what was streamed first
+    """
+    def __init__(self, message: str, partial: str = ""):
+        super().__init__(message)
+        self.partial = partial
+
+
+_VERTEX_INITED = False
+_VERTEX_INIT_LOCK = threading.Lock()
+
+
+def init_vertex(project_id: str, location: str):
+    """
+    Initialize Vertex AI once per process, however many clients are created
+    """
+    global _VERTEX_INITED
+    if _VERTEX_INITED:
+        return
+    with _VERTEX_INIT_LOCK:
+        if not _VERTEX_INITED:
+            # Deferred so importing this module doesn't pull in the Vertex AI SDK
+            import vertexai
+            vertexai.init(project=project_id, location=location)
+            _VERTEX_INITED = True
+
+
+@functools.lru_cache(maxsize=None)
+def _retryable() -> tuple:
+    """
+    Errors worth retrying; permission, validation and not-found errors fail fast
+    Looked up on first failure, since google.api_core pulls in gRPC
+    """
+    from google.api_core import exceptions as gax
+    return (gax.ServiceUnavailable, gax.DeadlineExceeded, gax.Aborted, gax.InternalServerError, gax.ResourceExhausted)
+
+
+@functools.lru_cache(maxsize=None)
+def _get_model(model_name: str) -> 'GenerativeModel':
+    """
+    One model per name, so every session shares its prediction client and channel
+    """
+    from vertexai.preview.generative_models import GenerativeModel
+    return GenerativeModel(model_name)
+
 
 class VertexClaude:
+    # Claude 3.5 Sonnet pricing per token ($3 / $15 per million)
+    _IN_RATE = 3e-6
+    _OUT_RATE = 1.5e-5
+    # Rough characters per token, only for responses without usage metadata
+    _CHARS_PER_TOKEN = 4
+    
     def __init__(self):
         # Get GCP project from environment or metadata
         self.project_id = os.getenv('GCP_PROJECT_ID')
         self.location = os.getenv('GCP_REGION', 'us-central1')
+        self.model_name = "claude-3-5-sonnet@20240620"
         
         # Initialize Vertex AI
         if self.project_id:
-            vertexai.init(project=self.project_id, location=self.location)
+            init_vertex(self.project_id, self.location)
             
             # Use Claude 3.5 Sonnet via Vertex AI Model Garden
-            # Model: claude-3-5-sonnet@20240620
-            self.model = GenerativeModel("claude-3-5-sonnet@20240620")
+            self.model = _get_model(self.model_name)
         else:
             self.model = None
+        
+        # Built system prompts by context items, least recently used first
+        self._prompt_cache: OrderedDict = OrderedDict()
+        self._prompt_lock = threading.Lock()
+        
+        # Usage accounting for this client, shared by concurrent chat_async calls
+        self.total_requests = 0
+        self.total_cost = 0.0
+        self._usage_lock = threading.Lock()
+        
+        # Last health_check result and when it was taken (time.monotonic())
+        self._last_hc = float('-inf')
+        self._last_hc_result: Dict = {}
+    
+    def health_check(self, deep: bool = False) -> Dict:
+        """
+        Check the model endpoint is reachable, reusing the result for a few seconds
+        The probe is a token count, which isn't billed; deep=True runs a real generation
+        """
+        if not self.model:
+            return {'status': 'not_configured', 'model': self.model_name}
+        
+        if not deep and time.monotonic() - self._last_hc < HEALTH_CHECK_TTL_SECONDS:
+            return self._last_hc_result
+        
+        try:
+            if deep:
+                self.model.generate_content("Respond with just 'OK'")
+            else:
+                self.model.count_tokens("OK")
+            result = {'status': 'ok', 'model': self.model_name}
+        except Exception as e:
+            result = {'status': 'error', 'model': self.model_name, 'error': str(e)}
+        
+        self._last_hc, self._last_hc_result = time.monotonic(), result
+        return result
     
     def chat(
         self, 
         user_message: str, 
         context: Dict = None,
-        conversation_history: List[Dict] = None
+        conversation_history: Sequence[Msg] = None
     ) -> str:
         """
         Send message to Claude via Vertex AI
         """
+        # Streams under the hood so both paths share prompting, retries and accounting
+        try:
+            return ''.join(self.chat_stream(user_message, context, conversation_history))
+        except ChatError as e:
+            return e.partial + str(e)
+    
+    async def chat_async(self, *args, **kwargs) -> str:
+        """
+        chat() on a worker thread, so concurrent requests don't serialize on Vertex AI
+        """
+        return await asyncio.to_thread(self.chat, *args, **kwargs)
+    
+    async def chat_many(self, requests: List[Dict]) -> List[str]:
+        """
+        Run several chat() requests (keyword arguments each) concurrently, in order
+        """
+        return await asyncio.gather(*(self.chat_async(**r) for r in requests))
+    
+    def chat_stream(
+        self,
+        user_message: str,
+        context: Dict = None,
+        conversation_history: Sequence[Msg] = None
+    ) -> Iterator[str]:
+        """
+        Send message to Claude via Vertex AI, yielding the response as it is generated
+        Raises ChatError if the request fails, so callers can tell a partial
+        answer from a complete one
+        """
         if not self.model:
-            return "❌ Vertex AI not configured. Set GCP_PROJECT_ID environment variable."
+            raise ChatError(NOT_CONFIGURED_MESSAGE)
         
-        # Build full prompt with context
-        system_prompt = self._build_system_prompt(context)
+        full_prompt = self._build_prompt(user_message, context, conversation_history)
+        output: List[str] = []
+        usage = None
         
-        # Format conversation history
-        full_prompt = system_prompt + "\n\n"
+        for attempt in range(MAX_ATTEMPTS):
+            try:
+                for chunk in self.model.generate_content(full_prompt, stream=True):
+                    # The final chunk carries the token counts for the whole response
+                    usage = getattr(chunk, 'usage_metadata', None) or usage
+                    output.append(chunk.text)
+                    yield chunk.text
+                return
+            
+            except Exception as e:
+                if output:
+                    # Part of the answer is already out; a retry would repeat it
+                    raise ChatError(self._error_message(e), ''.join(output)) from e
+                if isinstance(e, _retryable()) and attempt < MAX_ATTEMPTS - 1:
+                    # Capped backoff, jittered so concurrent callers don't retry in lockstep
+                    time.sleep(min(8, 2 ** attempt) + random.uniform(0, 0.5))
+                    continue
+                raise ChatError(self._error_message(e)) from e
+            
+            finally:
+                # Whatever was generated is billed, even if the caller stopped reading early
+                if output:
+                    self._record_usage(full_prompt, sum(map(len, output)), usage)
+    
+    def _build_prompt(
+        self,
+        user_message: str,
+        context: Dict = None,
+        conversation_history: Sequence[Msg] = None
+    ) -> str:
+        """
+        Build the full prompt: system prompt, recent history, then the new message
+        """
+        parts = [self._build_system_prompt(context), "\n\n"]
         
+        # Format conversation history
         if conversation_history:
-            for msg in conversation_history[-10:]:  # Last 10 messages for context
-                role = msg['role']
-                content = msg['content']
-                full_prompt += f"{role.upper()}: {content}\n\n"
-        
-        full_prompt += f"USER: {user_message}\n\nASSISTANT:"
+            # Latest turns, picked by index rather than slicing a copy;
+            # works for lists and deques alike
+            n = len(conversation_history)
+            for i in range(max(0, n - MAX_TURNS), n):
+                msg = conversation_history[i]
+                parts.extend((_ROLE_LABELS.get(msg.role) or msg.role.upper() + ": ", msg.content, "\n\n"))
         
-        try:
-            # Call Vertex AI Claude
-            response = self.model.generate_content(full_prompt)
-            return response.text
+        parts.append(f"USER: {user_message}\n\nASSISTANT:")
+        return ''.join(parts)
+    
+    def _record_usage(self, prompt: str, output_chars: int, usage=None) -> float:
+        """
+        Add a request's cost to the running totals, from the API's token counts
+        when present, otherwise estimated from prompt and output length
+        """
+        if usage and usage.prompt_token_count:
+            in_tokens, out_tokens = usage.prompt_token_count, usage.candidates_token_count
+        else:
+            in_tokens, out_tokens = len(prompt) / self._CHARS_PER_TOKEN, output_chars / self._CHARS_PER_TOKEN
         
-        except Exception as e:
-            return f"❌ Vertex AI Error: {str(e)}\n\nMake sure:\n1. Claude is enabled in Vertex AI Model Garden\n2. GCP_PROJECT_ID is set\n3. You have proper permissions"
+        cost = in_tokens * self._IN_RATE + out_tokens * self._OUT_RATE
+        with self._usage_lock:
+            self.total_requests += 1
+            self.total_cost += cost
+        return cost
+    
+    def _error_message(self, e: Exception) -> str:
+        return f"❌ Vertex AI Error: {str(e)}\n\nMake sure:\n1. Claude is enabled in Vertex AI Model Garden\n2. GCP_PROJECT_ID is set\n3. You have proper permissions"
     
     def _build_system_prompt(self, context: Dict = None) -> str:
         """
         Build system prompt with project context
+        Cached per distinct context, since a conversation reuses the same one
         """
-        base_prompt = """You are Claude, technical co-founder of a 90-day bootstrap mission to $15K/month.
-
-MISSION CONTEXT:
-- Founder: James (vision/vibe) + You (technical/execution)
-- Timeline: Oct 17, 2025 → Jan 15, 2026 (90 days)
-- Goal: $15K monthly recurring revenue
-- Primary Revenue: HAVEN Platform (community/service hub)
-- HQ: This Valhalla interface + GCP infrastructure
-- Philosophy: Ship fast, iterate, delegate to agents
-"""
+        key = tuple((k, repr(v)) for k, v in context.items()) if context else ()
         
-        if context:
-            base_prompt += "\n\nCURRENT PROJECT CONTEXT:\n"
-            for key, value in context.items():
-                base_prompt += f"- {key}: {value}\n"
+        with self._prompt_lock:
+            if key in self._prompt_cache:
+                self._prompt_cache.move_to_end(key)
+                return self._prompt_cache[key]
         
-        base_prompt += """
-You have full access to GCP infrastructure. When James asks you to build something:
-1. Design the architecture
-2. Generate the code
-3. Explain deployment steps
-4. Help execute via GCP services
-
-Be direct, technical, and action-oriented. No fluff."""
+        parts = [_BASE_PROMPT]
+        if context:
+            parts.append("\n\nCURRENT PROJECT CONTEXT:\n")
+            parts.extend(f"- {k}: {v}\n" for k, v in context.items())
+        parts.append(_PROMPT_FOOTER)
+        prompt = "".join(parts)
         
-        return base_prompt
\ No newline at end of file
+        with self._prompt_lock:
+            self._prompt_cache[key] = prompt
+            while len(self._prompt_cache) > PROMPT_CACHE_MAX:
+                self._prompt_cache.popitem(last=False)
+        return prompt
\ No newline at end of file